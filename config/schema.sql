@@ -20,8 +20,10 @@ CREATE TABLE IF NOT EXISTS agents (
     is_claimed BOOLEAN DEFAULT 0,  -- NEW: Has human owner
     submolt TEXT,                   -- NEW: Primary submolt
     platform TEXT DEFAULT 'moltbook',
+    primary_category TEXT,          -- Denormalized by the ranker for the read path
+    topics_csv TEXT,                -- All category names, highest confidence first
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    updated_at INTEGER DEFAULT (strftime('%s', 'now'))  -- Unix epoch seconds
 );
 
 -- Posts table (for engagement tracking)
@@ -47,7 +49,7 @@ CREATE TABLE IF NOT EXISTS categories (
     post_count INTEGER DEFAULT 0
 );
 
--- Agent categories (many-to-many)
+-- Agent categories (many-to-many); WITHOUT ROWID so rows live in the PK b-tree
 CREATE TABLE IF NOT EXISTS agent_categories (
     agent_id TEXT NOT NULL,
     category_id INTEGER NOT NULL,
@@ -55,7 +57,7 @@ CREATE TABLE IF NOT EXISTS agent_categories (
     PRIMARY KEY (agent_id, category_id),
     FOREIGN KEY (agent_id) REFERENCES agents(id),
     FOREIGN KEY (category_id) REFERENCES categories(id)
-);
+) WITHOUT ROWID;
 
 -- Rankings (calculated scores)
 CREATE TABLE IF NOT EXISTS rankings (
@@ -71,6 +73,22 @@ CREATE TABLE IF NOT EXISTS rankings (
     FOREIGN KEY (agent_id) REFERENCES agents(id)
 );
 
+-- Hash of each agent's scoring inputs at its last ranking, so unchanged agents are skipped
+CREATE TABLE IF NOT EXISTS ranking_cache (
+    agent_id TEXT PRIMARY KEY,
+    inputs_hash BLOB NOT NULL,
+    FOREIGN KEY (agent_id) REFERENCES agents(id)
+) WITHOUT ROWID;
+
+-- Top agents per category by overall score, rebuilt by the ranker after each pass
+CREATE TABLE IF NOT EXISTS top_agents_by_category (
+    category TEXT NOT NULL,
+    rank INTEGER NOT NULL,
+    agent_id TEXT NOT NULL,
+    PRIMARY KEY (category, rank),
+    FOREIGN KEY (agent_id) REFERENCES agents(id)
+) WITHOUT ROWID;
+
 -- Featured listings (paid)
 CREATE TABLE IF NOT EXISTS featured_listings (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -107,6 +125,26 @@ CREATE TABLE IF NOT EXISTS referrals (
     FOREIGN KEY (agent_id) REFERENCES agents(id)
 );
 
+-- Indexes for the top-N read paths (ORDER BY <score> DESC LIMIT n).
+-- rankings(agent_id) and agent_categories(agent_id) are covered by their primary keys.
+-- posts(agent_id) serves the ranker's per-agent lookups and its GROUP BY agent_id pass.
+-- No index on boolean flags like is_verified: the planner would pick it over the
+-- ordered score scan and fall back to sorting every match.
+CREATE INDEX IF NOT EXISTS idx_rankings_overall ON rankings(overall_score DESC, agent_id);
+CREATE INDEX IF NOT EXISTS idx_rankings_activity ON rankings(activity_score DESC);
+CREATE INDEX IF NOT EXISTS idx_rankings_engagement ON rankings(engagement_score DESC);
+CREATE INDEX IF NOT EXISTS idx_rankings_quality ON rankings(quality_score DESC);
+CREATE INDEX IF NOT EXISTS idx_rankings_recency ON rankings(recency_score DESC);
+CREATE INDEX IF NOT EXISTS idx_rankings_trending ON rankings(trending_score DESC);
+CREATE INDEX IF NOT EXISTS idx_agents_updated ON agents(updated_at DESC);
+CREATE INDEX IF NOT EXISTS idx_posts_agent ON posts(agent_id);
+CREATE INDEX IF NOT EXISTS idx_agent_categories_category ON agent_categories(category_id);
+
+-- Older databases stored agents.updated_at as local-time ISO text; convert those
+-- rows to epoch seconds so last_active sorts compare integers only
+UPDATE agents SET updated_at = CAST(strftime('%s', updated_at, 'utc') AS INTEGER)
+WHERE typeof(updated_at) = 'text';
+
 -- Insert default categories (expanded list)
 INSERT OR IGNORE INTO categories (name, description) VALUES
     ('coding', 'Software development, code review, programming help'),
@@ -1,22 +1,30 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
-import sqlite3
+from typing import Optional
+import orjson
 from pathlib import Path
 import uvicorn
 from datetime import datetime
 import os
+import re
+
+try:
+    from .db import cache_get, cache_put, connect, get_db, isoformat_ts, lifespan
+except ImportError:
+    # Run as a script (python src/api.py) rather than as src.api
+    from db import cache_get, cache_put, connect, get_db, isoformat_ts, lifespan
 
-DB_PATH = Path(__file__).parent.parent / "data" / "agent_ranker.db"
 FRONTEND_PATH = Path(__file__).parent.parent / "frontend"
+HAS_FRONTEND = (FRONTEND_PATH / "index.html").exists()
 
 app = FastAPI(
     title="AgentRanker",
     description="Discover and rank AI agents",
-    version="1.2.0"
+    version="1.2.0",
+    lifespan=lifespan
 )
 
 # CORS
@@ -28,8 +36,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def get_db():
-    return sqlite3.connect(DB_PATH)
+def _stream_export(query: str, params: tuple, header: dict, to_dict, total_key: str):
+    """
+    Stream a {..., "agents": [...]} export straight off the cursor, one
+    fetchmany batch per chunk, so large exports never sit in memory.
+    The row count is only known at the end, so it is written last.
+    
+    StreamingResponse iterates this from arbitrary threadpool threads, so
+    it reads on its own connection rather than a worker's get_db() one,
+    and closes it (ending the read snapshot) once the body is sent or the
+    client goes away.
+    """
+    conn = connect()
+    try:
+        cursor = conn.cursor()
+        cursor.arraysize = 500
+        cursor.execute(query, params)
+        yield orjson.dumps(header)[:-1] + b',"agents":['
+        total = 0
+        for batch in iter(cursor.fetchmany, []):
+            chunk = b",".join(orjson.dumps(to_dict(row)) for row in batch)
+            yield chunk if not total else b"," + chunk
+            total += len(batch)
+        yield b'],"' + total_key.encode() + b'":' + str(total).encode() + b"}"
+    finally:
+        conn.close()
 
 class AgentScore(BaseModel):
     overall: float
@@ -49,85 +80,114 @@ class Agent(BaseModel):
     category: Optional[str]
     last_active: Optional[str]
 
-@app.get("/")
-async def root():
-    if (FRONTEND_PATH / "index.html").exists():
-        return FileResponse(str(FRONTEND_PATH / "index.html"))
-    return {
-        "message": "AgentRanker API v1.2.0",
-        "endpoints": ["/agents/top", "/search", "/categories", "/export/agents.json", "/stats"],
-        "docs": "/docs"
-    }
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles that lets browsers/CDNs cache the frontend"""
+    FINGERPRINTED = re.compile(r"\.[0-9a-f]{8,}\.\w+$")
+    
+    def file_response(self, full_path, *args, **kwargs):
+        response = super().file_response(full_path, *args, **kwargs)
+        if self.FINGERPRINTED.search(str(full_path)):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        else:
+            response.headers["Cache-Control"] = "public, max-age=3600"
+        return response
+
+if not HAS_FRONTEND:
+    # Otherwise "/" is served by the frontend mount at the bottom of this file
+    @app.get("/")
+    async def root():
+        return {
+            "message": "AgentRanker API v1.2.0",
+            "endpoints": ["/agents/top", "/search", "/categories", "/export/agents.json", "/stats"],
+            "docs": "/docs"
+        }
 
 @app.get("/health")
 async def health():
     return {"status": "healthy"}
 
 @app.get("/agents/top")
-async def get_top_agents(
+def get_top_agents(
     category: Optional[str] = None,
     min_karma: Optional[float] = None,
     is_verified: Optional[bool] = None,
     sort_by: str = "karma",
     limit: int = 20
 ):
-    conn = get_db()
-    cursor = conn.cursor()
+    # Rankings only change on crawl, so a short TTL is enough
+    key = ("top", category, min_karma, is_verified, sort_by, limit)
+    cached = cache_get(key)
+    if cached is not None:
+        return Response(cached, media_type="application/json")
+    
+    cursor = get_db().cursor()
     
     query = """
         SELECT 
             a.id, a.username, a.display_name, a.bio,
-            a.follower_count, a.is_verified, a.updated_at,
-            r.overall_score, r.activity_score, r.engagement_score,
-            r.quality_score, r.recency_score
+            COALESCE(a.follower_count, 0) AS follower_count, a.is_verified, a.updated_at,
+            COALESCE(r.overall_score, 0) AS overall_score,
+            COALESCE(r.activity_score, 0) AS activity_score,
+            COALESCE(r.engagement_score, 0) AS engagement_score,
+            COALESCE(r.quality_score, 0) AS quality_score,
+            COALESCE(r.recency_score, 0) AS recency_score
         FROM agents a
-        LEFT JOIN rankings r ON a.id = r.agent_id
+        JOIN rankings r ON a.id = r.agent_id
         ORDER BY r.overall_score DESC
         LIMIT ?
     """
     
+    cursor.arraysize = 256
     cursor.execute(query, (limit,))
-    rows = cursor.fetchall()
-    conn.close()
     
-    return [{"id": row[0], "username": row[1], "display_name": row[2], 
-             "bio": row[3], "follower_count": row[4] or 0, "is_verified": row[5] or False,
-             "last_active": row[6],
-             "scores": {"overall": row[7] or 0, "activity": row[8] or 0, 
-                       "engagement": row[9] or 0, "quality": row[10] or 0, "recency": row[11] or 0}} 
-            for row in rows]
+    agents = [{"id": row["id"], "username": row["username"], "display_name": row["display_name"], 
+               "bio": row["bio"], "follower_count": row["follower_count"],
+               "is_verified": row["is_verified"] or False, "last_active": isoformat_ts(row["updated_at"]),
+               "scores": {"overall": row["overall_score"], "activity": row["activity_score"], 
+                         "engagement": row["engagement_score"], "quality": row["quality_score"],
+                         "recency": row["recency_score"]}} 
+              for batch in iter(cursor.fetchmany, []) for row in batch]
+    # Plain dicts from SQLite rows go straight to orjson, skipping
+    # jsonable_encoder and response-model validation
+    return Response(cache_put(key, orjson.dumps(agents), ttl=30), media_type="application/json")
 
 @app.get("/stats")
-async def get_stats():
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM agents")
-    agent_count = cursor.fetchone()[0]
-    cursor.execute("SELECT COUNT(*) FROM categories")
-    cat_count = cursor.fetchone()[0]
-    conn.close()
-    return {"agents": agent_count, "categories": cat_count, "version": "1.2.0"}
+def get_stats():
+    cached = cache_get(("stats",))
+    if cached is not None:
+        return Response(cached, media_type="application/json")
+    
+    cursor = get_db().cursor()
+    cursor.execute("""
+        SELECT (SELECT COUNT(*) FROM agents), (SELECT COUNT(*) FROM categories)
+    """)
+    agent_count, cat_count = cursor.fetchone()
+    body = orjson.dumps({"agents": agent_count, "categories": cat_count, "version": "1.2.0"})
+    return Response(cache_put(("stats",), body, ttl=60), media_type="application/json")
 
 @app.get("/export/agents.json")
-async def export_agents(limit: int = 100):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("""
+def export_agents(limit: int = 100):
+    query = """
         SELECT a.id, a.username, a.display_name, a.follower_count, 
                a.is_verified, r.overall_score
         FROM agents a
         LEFT JOIN rankings r ON a.id = r.agent_id
         LIMIT ?
-    """, (limit,))
-    rows = cursor.fetchall()
-    conn.close()
+    """
     
-    return {
-        "exported_at": datetime.now().isoformat(),
-        "total": len(rows),
-        "agents": [{"id": r[0], "username": r[1], "name": r[2], 
-                   "followers": r[3], "verified": r[4], "karma": r[5]} for r in rows]
-    }
+    return StreamingResponse(_stream_export(
+        query,
+        (limit,),
+        {"exported_at": datetime.now().isoformat()},
+        lambda r: {"id": r["id"], "username": r["username"], "name": r["display_name"], 
+                   "followers": r["follower_count"], "verified": r["is_verified"],
+                   "karma": r["overall_score"]},
+        "total"
+    ), media_type="application/json")
+
+# Mounted last so the API routes above take precedence
+if HAS_FRONTEND:
+    app.mount("/", CachedStaticFiles(directory=str(FRONTEND_PATH), html=True), name="frontend")
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 10000))
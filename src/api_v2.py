@@ -1,23 +1,25 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import FileResponse, Response
 from pydantic import BaseModel
 from typing import List, Optional
-import sqlite3
+import itertools
+import orjson
 from pathlib import Path
 import uvicorn
-from datetime import datetime, timedelta
 
-from crawler import MoltbookCrawler
-from ranking import RankingEngine
+from db import cache_get, cache_put, get_db, isoformat_ts, lifespan
 
-DB_PATH = Path(__file__).parent.parent / "data" / "agent_ranker.db"
 FRONTEND_PATH = Path(__file__).parent.parent / "frontend"
+INDEX_FILE = FRONTEND_PATH / "index.html"
+HAS_INDEX = INDEX_FILE.exists()
 
 app = FastAPI(
     title="AgentRanker",
     description="Discover and rank AI agents",
-    version="1.2.0"
+    version="1.2.0",
+    lifespan=lifespan
 )
 
 # Mount static files (frontend)
@@ -32,9 +34,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def get_db():
-    return sqlite3.connect(DB_PATH)
-
 class AgentScore(BaseModel):
     overall: float
     activity: float
@@ -57,12 +56,57 @@ class Agent(BaseModel):
     category: Optional[str]
     last_active: Optional[str]
 
+TOP_AGENTS_SELECT = """
+    SELECT 
+        a.id, a.username, a.display_name, a.bio, a.avatar_url,
+        a.follower_count, a.is_verified, a.is_claimed, a.submolt, a.updated_at as last_active,
+        r.overall_score, r.activity_score, r.engagement_score,
+        r.quality_score, r.recency_score, r.trending_score,
+        a.primary_category
+    FROM agents a
+    JOIN rankings r ON a.id = r.agent_id
+"""
+
+# Optional filters, in the order their params are bound
+TOP_AGENTS_FILTERS = (
+    # category: match any of the agent's categories, not just the primary one
+    """EXISTS (
+        SELECT 1 FROM agent_categories ac
+        JOIN categories c ON ac.category_id = c.id
+        WHERE ac.agent_id = a.id AND c.name = ?
+    )""",
+    "a.submolt = ?",
+    "r.overall_score >= ?",
+    "a.is_verified = ?",
+    "a.is_claimed = ?",
+)
+
+def _top_agents_where(flags):
+    clauses = [clause for clause, active in zip(TOP_AGENTS_FILTERS, flags) if active]
+    return " WHERE " + " AND ".join(clauses) if clauses else ""
+
+SORT_MAP = {
+    "karma": "r.overall_score",
+    "activity": "r.activity_score",
+    "engagement": "r.engagement_score",
+    "quality": "r.quality_score",
+    "recency": "r.recency_score",
+    "trending": "r.trending_score",
+    "last_active": "a.updated_at"
+}
+
+# One fixed SQL text per (filter combination, sort key), so sqlite3 reuses the prepared statement
+TOP_AGENTS_QUERIES = {
+    (flags, sort_by): f"{TOP_AGENTS_SELECT}{_top_agents_where(flags)} ORDER BY {column} DESC LIMIT ?"
+    for flags in itertools.product((False, True), repeat=len(TOP_AGENTS_FILTERS))
+    for sort_by, column in SORT_MAP.items()
+}
+
 @app.get("/")
 async def root():
     """Serve frontend or API info"""
-    if (FRONTEND_PATH / "index.html").exists():
-        from fastapi.responses import FileResponse
-        return FileResponse(str(FRONTEND_PATH / "index.html"))
+    if HAS_INDEX:
+        return FileResponse(INDEX_FILE)
     return {
         "message": "AgentRanker API",
         "version": "1.2.0",
@@ -82,116 +126,75 @@ async def root():
 async def health():
     return {"status": "healthy", "version": "1.2.0"}
 
-@app.get("/agents/top", response_model=List[Agent])
-async def get_top_agents(
+def _query_top(category, submolt, min_karma, is_verified, is_claimed, sort_by, limit) -> bytes:
+    """Top agents as encoded JSON, shared by /agents/top and /trending so both hit one cache"""
+    key = (category, submolt, min_karma, is_verified, is_claimed, sort_by, limit)
+    cached = cache_get(key)
+    if cached is not None:
+        return cached
+    
+    cursor = get_db().cursor()
+    
+    filters = (
+        category or None,
+        submolt or None,
+        min_karma,
+        None if is_verified is None else int(is_verified),
+        None if is_claimed is None else int(is_claimed),
+    )
+    query = TOP_AGENTS_QUERIES[tuple(f is not None for f in filters), sort_by]
+    params = [f for f in filters if f is not None]
+    params.append(limit)
+    
+    cursor.arraysize = 100
+    cursor.execute(query, params)
+    
+    # Trusted DB rows go straight to orjson, skipping Pydantic validation
+    # and jsonable_encoder; the casts keep the JSON identical to Agent's
+    agents = [{
+        "id": row["id"],
+        "username": row["username"],
+        "display_name": row["display_name"],
+        "bio": row["bio"],
+        "avatar_url": row["avatar_url"],
+        "follower_count": row["follower_count"] or 0,
+        "is_verified": bool(row["is_verified"]),
+        "is_claimed": None if row["is_claimed"] is None else bool(row["is_claimed"]),
+        "submolt": row["submolt"],
+        "scores": {
+            "overall": row["overall_score"] or 0.0,
+            "activity": row["activity_score"] or 0.0,
+            "engagement": row["engagement_score"] or 0.0,
+            "quality": row["quality_score"] or 0.0,
+            "recency": row["recency_score"] or 0.0,
+            "trending": row["trending_score"] or 0.0
+        },
+        "category": category or row["primary_category"],
+        "last_active": isoformat_ts(row["last_active"])
+    } for row in cursor]
+    
+    return cache_put(key, orjson.dumps(agents), ttl=30)
+
+# Handlers return pre-encoded JSON; Agent only documents the response shape
+@app.get("/agents/top", response_class=Response, responses={200: {"model": List[Agent]}})
+def get_top_agents(
     category: Optional[str] = None,
     submolt: Optional[str] = None,
     min_karma: Optional[float] = None,
     is_verified: Optional[bool] = None,
     is_claimed: Optional[bool] = None,
-    sort_by: str = Query("karma", pattern="^(karma|activity|engagement|quality|recency|trending|last_active)$"),
+    sort_by: str = Query("karma", pattern=f"^({'|'.join(SORT_MAP)})$"),
     limit: int = Query(20, ge=1, le=100)
 ):
     """Get top ranked agents with advanced filters"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    query = """
-        SELECT 
-            a.id, a.username, a.display_name, a.bio, a.avatar_url,
-            a.follower_count, a.is_verified, a.is_claimed, a.submolt, a.updated_at as last_active,
-            r.overall_score, r.activity_score, r.engagement_score,
-            r.quality_score, r.recency_score, r.trending_score,
-            GROUP_CONCAT(c.name) as categories
-        FROM agents a
-        LEFT JOIN rankings r ON a.id = r.agent_id
-        LEFT JOIN agent_categories ac ON a.id = ac.agent_id
-        LEFT JOIN categories c ON ac.category_id = c.id
-    """
-    
-    params = []
-    where_clauses = []
-    
-    if category:
-        query = query.replace(
-            "LEFT JOIN agent_categories ac ON a.id = ac.agent_id",
-            "JOIN agent_categories ac ON a.id = ac.agent_id"
-        ).replace(
-            "LEFT JOIN categories c ON ac.category_id = c.id",
-            "JOIN categories c ON ac.category_id = c.id AND c.name = ?"
-        )
-        params.append(category)
-    
-    if submolt:
-        where_clauses.append("a.submolt = ?")
-        params.append(submolt)
-    
-    if min_karma is not None:
-        where_clauses.append("r.overall_score >= ?")
-        params.append(min_karma)
-    
-    if is_verified is not None:
-        where_clauses.append("a.is_verified = ?")
-        params.append(1 if is_verified else 0)
-    
-    if is_claimed is not None:
-        where_clauses.append("a.is_claimed = ?")
-        params.append(1 if is_claimed else 0)
-    
-    if where_clauses:
-        query += " WHERE " + " AND ".join(where_clauses)
-    
-    query += " GROUP BY a.id"
-    
-    # Sorting
-    sort_map = {
-        "karma": "r.overall_score",
-        "activity": "r.activity_score",
-        "engagement": "r.engagement_score",
-        "quality": "r.quality_score",
-        "recency": "r.recency_score",
-        "trending": "r.trending_score",
-        "last_active": "a.updated_at"
-    }
-    query += f" ORDER BY {sort_map.get(sort_by, 'r.overall_score')} DESC"
-    
-    query += " LIMIT ?"
-    params.append(limit)
-    
-    cursor.execute(query, params)
-    rows = cursor.fetchall()
-    conn.close()
-    
-    agents = []
-    for row in rows:
-        agents.append(Agent(
-            id=row[0],
-            username=row[1],
-            display_name=row[2],
-            bio=row[3],
-            avatar_url=row[4],
-            follower_count=row[5] or 0,
-            is_verified=row[6] or False,
-            is_claimed=row[7],
-            submolt=row[8],
-            last_active=row[9],
-            scores=AgentScore(
-                overall=row[10] or 0,
-                activity=row[11] or 0,
-                engagement=row[12] or 0,
-                quality=row[13] or 0,
-                recency=row[14] or 0,
-                trending=row[15] or 0
-            ),
-            category=row[16].split(",")[0] if row[16] else None
-        ))
-    
-    return agents
+    body = _query_top(category, submolt, min_karma, is_verified, is_claimed, sort_by, limit)
+    return Response(body, media_type="application/json")
 
-@app.get("/trending", response_model=List[Agent])
-async def get_trending(limit: int = Query(10, ge=1, le=50)):
+@app.get("/trending", response_class=Response, responses={200: {"model": List[Agent]}})
+def get_trending(limit: int = Query(10, ge=1, le=50)):
     """Get trending agents (rising quickly)"""
-    return await get_top_agents(sort_by="trending", limit=limit)
+    body = _query_top(None, None, None, None, None, "trending", limit)
+    return Response(body, media_type="application/json")
 
 # ... rest of endpoints (search, categories, stats, export) ...
 
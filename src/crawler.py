@@ -6,23 +6,96 @@ Scrapes agent data from Moltbook for ranking
 
 import sqlite3
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import re
 import json
-from datetime import datetime, timedelta
 from pathlib import Path
 from typing import List, Dict, Optional
+from collections import defaultdict
 import time
+import os
+
+from db import apply_schema
 
 # Config
 DB_PATH = Path(__file__).parent.parent / "data" / "agent_ranker.db"
 MOLTBOOK_API_BASE = "https://www.moltbook.com/api/v1"
 RATE_LIMIT_DELAY = 1  # Seconds between requests
 
+# Update only the crawled columns so a re-crawl keeps the denormalized
+# primary_category / topics_csv written by the ranker
+AGENT_UPSERT_SQL = """
+    INSERT INTO agents 
+    (id, username, display_name, bio, avatar_url, joined_at, 
+     follower_count, is_verified, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET
+        username = excluded.username,
+        display_name = excluded.display_name,
+        bio = excluded.bio,
+        avatar_url = excluded.avatar_url,
+        joined_at = excluded.joined_at,
+        follower_count = excluded.follower_count,
+        is_verified = excluded.is_verified,
+        updated_at = excluded.updated_at
+"""
+
+POST_UPSERT_SQL = """
+    INSERT OR REPLACE INTO posts 
+    (id, agent_id, title, content, submolt, upvotes, downvotes, 
+     comment_count, posted_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Update in place rather than delete + reinsert on a repeat crawl
+AGENT_CATEGORY_UPSERT_SQL = """
+    INSERT INTO agent_categories (agent_id, category_id, confidence)
+    VALUES (?, ?, ?)
+    ON CONFLICT(agent_id, category_id) DO UPDATE SET confidence = excluded.confidence
+"""
+
+# Keyword-based categorization; keywords match whole words (or their inflected
+# forms, see KEYWORD_FORMS) in an agent's posts
+CATEGORY_KEYWORDS = {
+    "coding": frozenset({"code", "python", "javascript", "programming", "developer", "api", "github", "script", "automation", "dev"}),
+    "trading": frozenset({"trade", "crypto", "bitcoin", "ethereum", "market", "price", "signal", "profit", "loss", "portfolio"}),
+    "research": frozenset({"research", "analyze", "study", "data", "report", "findings", "investigate"}),
+    "writing": frozenset({"write", "content", "blog", "article", "copy", "story", "documentation"}),
+    "design": frozenset({"design", "ui", "ux", "visual", "graphic", "art", "creative"}),
+    "automation": frozenset({"automation", "workflow", "cron", "script", "bot", "schedule", "integrate"}),
+    "community": frozenset({"community", "moderate", "engage", "social", "discord", "telegram"}),
+    "data": frozenset({"data", "scrape", "extract", "csv", "json", "database", "analyze"}),
+    "marketing": frozenset({"marketing", "seo", "growth", "viral", "promote", "audience"})
+}
+
+WORD_RE = re.compile(r"[a-z]+")
+
+def _word_forms(keyword: str) -> set:
+    """Plural, -ed, -ing and -er forms of a keyword ("markets", "trading", "developers")"""
+    stem = keyword[:-1] if keyword.endswith("e") else keyword
+    forms = {keyword + "s", keyword + "es", stem + "ed", stem + "ing", stem + "er", stem + "ers"}
+    if keyword.endswith("y"):
+        forms |= {keyword[:-1] + "ies", keyword[:-1] + "ied"}
+    return forms
+
+# Each token form maps back to the keyword it counts as. Exact keywords win,
+# so "marketing" is the marketing keyword rather than a form of "market"
+KEYWORD_FORMS = {form: keyword for keywords in CATEGORY_KEYWORDS.values()
+                 for keyword in keywords for form in _word_forms(keyword)}
+KEYWORD_FORMS.update((keyword, keyword) for keywords in CATEGORY_KEYWORDS.values() for keyword in keywords)
+
 class MoltbookCrawler:
     def __init__(self, api_key: Optional[str] = None):
         self.db_path = DB_PATH
         self.api_key = api_key
         self.session = requests.Session()
+        # Keep-alive pool reused across requests; transient errors and 429s are retried with backoff
+        self.session.mount("https://", HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=16,
+            max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+        ))
         self.session.headers.update({
             "User-Agent": "AgentRanker/1.0 (Analysis Bot)",
             "Accept": "application/json"
@@ -30,20 +103,42 @@ class MoltbookCrawler:
         if api_key:
             self.session.headers["Authorization"] = f"Bearer {api_key}"
         
+        self._conn = None
+        self._last_request = 0.0
         self._init_db()
     
     def _init_db(self):
         """Initialize database with schema"""
         DB_PATH.parent.mkdir(exist_ok=True)
-        conn = sqlite3.connect(self.db_path)
-        with open(Path(__file__).parent.parent / "config" / "schema.sql", "r") as f:
-            conn.executescript(f.read())
+        conn = self._get_db()
+        apply_schema(conn)
         conn.commit()
-        conn.close()
     
     def _get_db(self):
-        """Get database connection"""
-        return sqlite3.connect(self.db_path)
+        """Get the crawler's database connection, opened once and reused"""
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path)
+            self._conn.executescript("""
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=NORMAL;
+                PRAGMA temp_store=MEMORY;
+                PRAGMA cache_size=-64000;
+                PRAGMA busy_timeout=30000;
+            """)
+        return self._conn
+    
+    def close(self):
+        """Close the database connection"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+    
+    def _throttle(self):
+        """Keep at least RATE_LIMIT_DELAY between API requests"""
+        wait = self._last_request + RATE_LIMIT_DELAY - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self._last_request = time.monotonic()
     
     def fetch_recent_posts(self, limit: int = 100) -> List[Dict]:
         """Fetch recent posts from Moltbook"""
@@ -52,6 +147,7 @@ class MoltbookCrawler:
             url = f"{MOLTBOOK_API_BASE}/posts"
             params = {"submolt": "general", "limit": limit}
             
+            self._throttle()
             response = self.session.get(url, params=params, timeout=30)
             
             if response.status_code == 200:
@@ -86,27 +182,16 @@ class MoltbookCrawler:
         categories = []
         
         # Combine all text from agent's posts
-        all_text = " ".join([
-            f"{p.get('title', '')} {p.get('content', '')}"
-            for p in posts
-        ]).lower()
-        
-        # Keyword-based categorization
-        category_keywords = {
-            "coding": ["code", "python", "javascript", "programming", "developer", "api", "github", "script", "automation", "dev"],
-            "trading": ["trade", "crypto", "bitcoin", "ethereum", "market", "price", "signal", "profit", "loss", "portfolio"],
-            "research": ["research", "analyze", "study", "data", "report", "findings", "investigate"],
-            "writing": ["write", "content", "blog", "article", "copy", "story", "documentation"],
-            "design": ["design", "ui", "ux", "visual", "graphic", "art", "creative"],
-            "automation": ["automation", "workflow", "cron", "script", "bot", "schedule", "integrate"],
-            "community": ["community", "moderate", "engage", "social", "discord", "telegram"],
-            "data": ["data", "scrape", "extract", "csv", "json", "database", "analyze"],
-            "marketing": ["marketing", "seo", "growth", "viral", "promote", "audience"]
-        }
+        all_text = " ".join(
+            text for p in posts for text in (p.get("title"), p.get("content")) if text
+        ).lower()
         
-        for category, keywords in category_keywords.items():
-            score = sum(1 for kw in keywords if kw in all_text)
-            if score >= 2:  # At least 2 keyword matches
+        # Tokenize once and fold inflected forms onto their keyword, then each
+        # category is a set intersection over distinct keywords
+        tokens = set(WORD_RE.findall(all_text))
+        matched = {KEYWORD_FORMS[token] for token in tokens & KEYWORD_FORMS.keys()}
+        for category, keywords in CATEGORY_KEYWORDS.items():
+            if len(keywords & matched) >= 2:  # At least 2 keyword matches
                 categories.append(category)
         
         if not categories:
@@ -114,17 +199,8 @@ class MoltbookCrawler:
         
         return categories
     
-    def save_agent(self, agent: Dict):
-        """Save agent to database"""
-        conn = self._get_db()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            INSERT OR REPLACE INTO agents 
-            (id, username, display_name, bio, avatar_url, joined_at, 
-             follower_count, is_verified, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
+    def _agent_row(self, agent: Dict, updated_at: int) -> tuple:
+        return (
             agent["id"],
             agent["username"],
             agent.get("display_name"),
@@ -133,30 +209,17 @@ class MoltbookCrawler:
             agent.get("joined_at"),
             agent.get("follower_count", 0),
             agent.get("is_verified", False),
-            datetime.now().isoformat()
-        ))
-        
-        conn.commit()
-        conn.close()
+            updated_at
+        )
     
-    def save_post(self, post: Dict):
-        """Save post to database"""
-        conn = self._get_db()
-        cursor = conn.cursor()
-        
+    def _post_row(self, post: Dict) -> Optional[tuple]:
         author = post.get("author", {})
         agent_id = author.get("id") if author else None
         
         if not agent_id:
-            conn.close()
-            return
+            return None
         
-        cursor.execute("""
-            INSERT OR REPLACE INTO posts 
-            (id, agent_id, title, content, submolt, upvotes, downvotes, 
-             comment_count, posted_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
+        return (
             post.get("id"),
             agent_id,
             post.get("title", ""),
@@ -166,32 +229,36 @@ class MoltbookCrawler:
             post.get("downvotes", 0),
             post.get("comment_count", 0),
             post.get("created_at")
-        ))
-        
-        conn.commit()
-        conn.close()
+        )
+    
+    def _category_ids(self) -> Dict[str, int]:
+        """Category name -> id, fetched once per batch"""
+        return dict(self._get_db().execute("SELECT name, id FROM categories"))
+    
+    def _category_rows(self, agent_id: str, categories: List[str], category_ids: Dict[str, int]) -> List[tuple]:
+        return [(agent_id, category_ids[name], 0.7) for name in categories if name in category_ids]
+    
+    def save_batch(self, agent_rows: List[tuple], post_rows: List[tuple], category_rows: List[tuple]):
+        """Write agents, posts and agent categories in a single transaction"""
+        conn = self._get_db()
+        with conn:
+            conn.executemany(AGENT_UPSERT_SQL, agent_rows)
+            conn.executemany(POST_UPSERT_SQL, post_rows)
+            conn.executemany(AGENT_CATEGORY_UPSERT_SQL, category_rows)
+    
+    def save_agent(self, agent: Dict):
+        """Save agent to database"""
+        self.save_batch([self._agent_row(agent, int(time.time()))], [], [])
+    
+    def save_post(self, post: Dict):
+        """Save post to database"""
+        row = self._post_row(post)
+        if row:
+            self.save_batch([], [row], [])
     
     def save_categories(self, agent_id: str, categories: List[str]):
         """Save agent categories"""
-        conn = self._get_db()
-        cursor = conn.cursor()
-        
-        for category_name in categories:
-            # Get category ID
-            cursor.execute("SELECT id FROM categories WHERE name = ?", (category_name,))
-            row = cursor.fetchone()
-            
-            if row:
-                category_id = row[0]
-                
-                # Link agent to category
-                cursor.execute("""
-                    INSERT OR REPLACE INTO agent_categories (agent_id, category_id, confidence)
-                    VALUES (?, ?, ?)
-                """, (agent_id, category_id, 0.7))
-        
-        conn.commit()
-        conn.close()
+        self.save_batch([], [], self._category_rows(agent_id, categories, self._category_ids()))
     
     def crawl(self, post_limit: int = 100):
         """Main crawl function"""
@@ -201,33 +268,43 @@ class MoltbookCrawler:
         print(f"📥 Fetched {len(posts)} posts")
         
         agents_processed = set()
+        category_ids = self._category_ids()
+        now_ts = int(time.time())  # One updated_at (epoch seconds) for the whole crawl
+        agent_rows, post_rows, category_rows = [], [], []
+        
+        # Group posts by author once for categorization
+        posts_by_author = defaultdict(list)
+        for post in posts:
+            posts_by_author[(post.get("author") or {}).get("id")].append(post)
         
         for post in posts:
-            # Save post
-            self.save_post(post)
+            post_row = self._post_row(post)
+            if post_row:
+                post_rows.append(post_row)
             
-            # Extract and save agent
+            # Extract agent
             agent = self.extract_agent_from_post(post)
             if agent and agent["id"] not in agents_processed:
-                self.save_agent(agent)
+                agent_rows.append(self._agent_row(agent, now_ts))
                 agents_processed.add(agent["id"])
                 
-                # Get all posts from this agent for categorization
-                agent_posts = [p for p in posts if p.get("author", {}).get("id") == agent["id"]]
-                categories = self.categorize_agent(agent, agent_posts)
-                self.save_categories(agent["id"], categories)
+                categories = self.categorize_agent(agent, posts_by_author[agent["id"]])
+                category_rows.extend(self._category_rows(agent["id"], categories, category_ids))
                 
                 print(f"  ✓ Indexed: {agent['username']} ({', '.join(categories)})")
-            
-            time.sleep(RATE_LIMIT_DELAY)
+        
+        # One transaction for the whole crawl instead of a commit per row
+        self.save_batch(agent_rows, post_rows, category_rows)
         
         print(f"✅ Crawl complete. Indexed {len(agents_processed)} agents")
         return len(agents_processed)
 
 if __name__ == "__main__":
-    # Use the API key from memory
-    API_KEY = "moltbook_sk_-wMhZ7jrsOWTCifzeKwY-xI29vjhp_JW"
+    API_KEY = os.environ.get("MOLTBOOK_API_KEY")
+    if not API_KEY:
+        print("⚠️  MOLTBOOK_API_KEY not set, crawling unauthenticated")
     
     crawler = MoltbookCrawler(api_key=API_KEY)
     count = crawler.crawl(post_limit=100)
+    crawler.close()
     print(f"\nTotal agents indexed: {count}")
@@ -0,0 +1,106 @@
+"""
+Agent Ranker - Database helpers
+Schema setup shared by every entry point, plus the SQLite connections and
+response cache used by api.py and api_v2.py
+"""
+
+import sqlite3
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+DB_PATH = Path(__file__).parent.parent / "data" / "agent_ranker.db"
+SCHEMA_PATH = Path(__file__).parent.parent / "config" / "schema.sql"
+
+def apply_schema(conn):
+    """
+    Bring the database up to the current schema. The crawler, mock data,
+    ranker and APIs all call this, so a database created by an older schema
+    is migrated by whichever of them opens it first
+    """
+    with open(SCHEMA_PATH, "r") as f:
+        conn.executescript(f.read())
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(agents)")}
+    for column in ("primary_category", "topics_csv"):
+        if column not in columns:
+            # CREATE TABLE IF NOT EXISTS leaves an older agents table as is
+            try:
+                conn.execute(f"ALTER TABLE agents ADD COLUMN {column} TEXT")
+            except sqlite3.OperationalError as e:
+                # Another process added it since we read table_info
+                if "duplicate column" not in str(e):
+                    raise
+
+def connect():
+    # Room for all api_v2 TOP_AGENTS_QUERIES variants in the prepared-statement cache
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None,
+                           cached_statements=256)
+    # WAL lets readers run alongside the crawler/ranker writes; busy_timeout
+    # waits out lock contention instead of raising SQLITE_BUSY
+    conn.executescript("""
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA mmap_size=268435456;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA cache_size=-64000;
+        PRAGMA busy_timeout=30000;
+    """)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+# DB handlers are plain `def`, so FastAPI runs them in its threadpool; each
+# worker thread keeps its own long-lived connection and WAL lets them read
+# in parallel instead of serializing on one shared connection
+class _ThreadConnection:
+    """A worker thread's connection, closed once the thread exits and its locals are dropped"""
+    def __init__(self):
+        self.conn = connect()
+        weakref.finalize(self, self.conn.close)
+
+_local = threading.local()
+# Holders of threads still alive, so shutdown can close what's left
+_live = weakref.WeakSet()
+
+def get_db():
+    holder = getattr(_local, "holder", None)
+    if holder is None:
+        holder = _local.holder = _ThreadConnection()
+        _live.add(holder)
+    return holder.conn
+
+@asynccontextmanager
+async def lifespan(app):
+    DB_PATH.parent.mkdir(exist_ok=True)
+    conn = connect()
+    try:
+        apply_schema(conn)
+    finally:
+        conn.close()
+    yield
+    for holder in list(_live):
+        holder.conn.close()
+
+# Pre-serialized JSON bodies, keyed by endpoint + params. The crawler and
+# ranker run as separate processes, so entries simply expire.
+_response_cache = {}
+RESPONSE_CACHE_MAX = 512
+
+def cache_get(key) -> Optional[bytes]:
+    hit = _response_cache.get(key)
+    if hit and hit[0] > time.monotonic():
+        return hit[1]
+    return None
+
+def cache_put(key, body: bytes, ttl: int) -> bytes:
+    if len(_response_cache) >= RESPONSE_CACHE_MAX:
+        _response_cache.clear()
+    _response_cache[key] = (time.monotonic() + ttl, body)
+    return body
+
+def isoformat_ts(ts):
+    """agents.updated_at is stored as epoch seconds; format it only for the response"""
+    return datetime.fromtimestamp(ts).isoformat() if isinstance(ts, int) else ts
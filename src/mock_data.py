@@ -4,17 +4,19 @@ Agent Ranker - Moltbook Crawler (Mock data version for testing)
 """
 
 import sqlite3
+import time
 from datetime import datetime, timedelta
 from pathlib import Path
 
+from db import apply_schema
+
 DB_PATH = Path(__file__).parent.parent / "data" / "agent_ranker.db"
 
 def init_db():
     """Initialize database"""
     DB_PATH.parent.mkdir(exist_ok=True)
     conn = sqlite3.connect(DB_PATH)
-    with open(Path(__file__).parent.parent / "config" / "schema.sql", "r") as f:
-        conn.executescript(f.read())
+    apply_schema(conn)
     conn.commit()
     conn.close()
 
@@ -117,52 +119,59 @@ def add_mock_agents():
     ]
     
     print(f"📝 Adding {len(mock_agents)} mock agents...")
+    now_ts = int(time.time())
+    now = datetime.now()
+    cat_map = dict(cursor.execute("SELECT name, id FROM categories"))
     
-    for agent in mock_agents:
-        # Insert agent
-        cursor.execute("""
-            INSERT OR REPLACE INTO agents 
-            (id, username, display_name, bio, follower_count, is_verified, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (
+    agent_rows = [
+        (agent["id"], agent["username"], agent["display_name"], agent["bio"],
+         agent["follower_count"], agent["is_verified"], now_ts)
+        for agent in mock_agents
+    ]
+    cat_rows = [
+        (agent["id"], cat_map[cat_name], 0.8)
+        for agent in mock_agents
+        for cat_name in agent["categories"] if cat_name in cat_map
+    ]
+    # 5 mock posts per agent
+    post_rows = [
+        (
+            f"post_{agent['id']}_{i}",
             agent["id"],
-            agent["username"],
-            agent["display_name"],
-            agent["bio"],
-            agent["follower_count"],
-            agent["is_verified"],
-            datetime.now().isoformat()
-        ))
-        
-        # Add categories
-        for cat_name in agent["categories"]:
-            cursor.execute("SELECT id FROM categories WHERE name = ?", (cat_name,))
-            row = cursor.fetchone()
-            if row:
-                cat_id = row[0]
-                cursor.execute("""
-                    INSERT OR REPLACE INTO agent_categories (agent_id, category_id, confidence)
-                    VALUES (?, ?, ?)
-                """, (agent["id"], cat_id, 0.8))
-        
-        # Add mock posts
-        for i in range(5):
-            cursor.execute("""
-                INSERT OR REPLACE INTO posts 
-                (id, agent_id, title, content, upvotes, downvotes, comment_count, posted_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                f"post_{agent['id']}_{i}",
-                agent["id"],
-                f"Sample post {i}",
-                f"Content from {agent['username']}",
-                agent["follower_count"] // 10 + i * 5,
-                i,
-                i * 2,
-                (datetime.now() - timedelta(days=i)).isoformat()
-            ))
+            f"Sample post {i}",
+            f"Content from {agent['username']}",
+            agent["follower_count"] // 10 + i * 5,
+            i,
+            i * 2,
+            (now - timedelta(days=i)).isoformat()
+        )
+        for agent in mock_agents
+        for i in range(5)
+    ]
     
-    conn.commit()
+    with conn:
+        cursor.executemany("""
+            INSERT INTO agents 
+            (id, username, display_name, bio, follower_count, is_verified, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                username = excluded.username,
+                display_name = excluded.display_name,
+                bio = excluded.bio,
+                follower_count = excluded.follower_count,
+                is_verified = excluded.is_verified,
+                updated_at = excluded.updated_at
+        """, agent_rows)
+        cursor.executemany("""
+            INSERT INTO agent_categories (agent_id, category_id, confidence)
+            VALUES (?, ?, ?)
+            ON CONFLICT(agent_id, category_id) DO UPDATE SET confidence = excluded.confidence
+        """, cat_rows)
+        cursor.executemany("""
+            INSERT OR REPLACE INTO posts 
+            (id, agent_id, title, content, upvotes, downvotes, comment_count, posted_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, post_rows)
     conn.close()
     
     print(f"✅ Added {len(mock_agents)} mock agents with posts")
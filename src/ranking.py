@@ -9,15 +9,211 @@ from datetime import datetime, timedelta
 from pathlib import Path
 from typing import List, Dict, Tuple
 import math
+import hashlib
+from bisect import bisect_right
+
+from db import apply_schema
 
 DB_PATH = Path(__file__).parent.parent / "data" / "agent_ranker.db"
 
+# Whole days since an agent's latest post, computed by SQLite. Naive timestamps
+# are local time ('utc' converts them); 'Z'/offset ones already carry their zone.
+# NULL when there are no posts or posted_at doesn't parse.
+DAYS_SINCE_LAST_POST = "CAST(julianday('now') - julianday(MAX(posted_at), 'utc') AS INTEGER)"
+
+# Quality inputs with the profile-completeness checks done by SQLite, so only
+# flags cross into Python instead of whole bios
+QUALITY_COLUMNS = """is_verified, LENGTH(bio) > 20, follower_count,
+                     display_name IS NOT NULL AND display_name <> ''"""
+
+# Day buckets as lookup tables: bisect_right(bounds, days) picks the score
+# (< 1 day, < 7, < 30, < 90, older)
+RECENCY_DAY_BOUNDS = (1, 7, 30, 90)
+RECENCY_SCORES = (100, 80, 50, 25, 10)  # Exponential decay
+ACTIVITY_BONUS_DAY_BOUNDS = (1, 7, 30)
+ACTIVITY_BONUSES = (25, 15, 5, 0)
+
+# Activity base score is logarithmic in post count and capped at 50, which
+# every count from ACTIVITY_BASE_CAP_POSTS up reaches; tabulate the rest
+ACTIVITY_BASE_CAP_POSTS = math.ceil(10 ** (50 / 20)) - 1
+ACTIVITY_BASE_SCORES = tuple(min(math.log10(n + 1) * 20, 50) for n in range(ACTIVITY_BASE_CAP_POSTS + 1))
+
+# Weighted average
+# Engagement and quality matter more than raw activity
+SCORE_WEIGHTS = {"activity": 0.25, "engagement": 0.35, "quality": 0.25, "recency": 0.15}
+OVERALL_SCORE_SQL = " + ".join(f"{component} * {weight}" for component, weight in SCORE_WEIGHTS.items())
+
+# Depth of the precomputed per-category leaderboards in top_agents_by_category
+TOP_AGENTS_PER_CATEGORY = 100
+
+# Bump when the scoring rules change so every ranking_cache entry is recomputed
+SCORING_VERSION = 1
+
+# Pure scoring functions over already-fetched values, shared by the
+# per-agent calculate_* methods and the bulk update_all_rankings pass
+
+def _activity_from_row(post_count, days_since) -> float:
+    if not post_count:
+        return 0.0
+    
+    # Base score from post count (logarithmic scaling)
+    base_score = ACTIVITY_BASE_SCORES[min(post_count, ACTIVITY_BASE_CAP_POSTS)]
+    
+    # Recency bonus
+    recency_bonus = 0
+    if days_since is not None:
+        recency_bonus = ACTIVITY_BONUSES[bisect_right(ACTIVITY_BONUS_DAY_BOUNDS, days_since)]
+    
+    return min(base_score + recency_bonus, 100)
+
+def _engagement_from_row(total_upvotes, total_downvotes, total_comments, post_count) -> float:
+    if not total_upvotes:
+        return 0.0
+    
+    total_downvotes = total_downvotes or 0
+    total_comments = total_comments or 0
+    post_count = post_count or 1
+    
+    # Upvote ratio (quality signal)
+    total_votes = total_upvotes + total_downvotes
+    if total_votes > 0:
+        upvote_ratio = total_upvotes / total_votes
+    else:
+        upvote_ratio = 0.5
+    
+    # Average engagement per post
+    avg_upvotes = total_upvotes / post_count
+    avg_comments = total_comments / post_count
+    
+    # Score components
+    upvote_score = min(avg_upvotes * 5, 40)  # Cap at 40
+    comment_score = min(avg_comments * 10, 30)  # Cap at 30
+    ratio_score = upvote_ratio * 20  # Max 20
+    
+    return min(upvote_score + comment_score + ratio_score, 100)
+
+def _quality_from_row(is_verified, has_long_bio, follower_count, has_display_name) -> float:
+    score = 0
+    
+    # Verification bonus
+    if is_verified:
+        score += 30
+    
+    # Profile completeness
+    if has_long_bio:
+        score += 20
+    if has_display_name:
+        score += 10
+    
+    # Social proof (followers)
+    if follower_count:
+        if follower_count > 1000:
+            score += 20
+        elif follower_count > 100:
+            score += 15
+        elif follower_count > 10:
+            score += 10
+    
+    return min(score, 100)
+
+def _recency_from_row(days_since) -> float:
+    if days_since is None:
+        return 0.0
+    
+    return RECENCY_SCORES[bisect_right(RECENCY_DAY_BOUNDS, days_since)]
+
+def _score_breakdown(activity: float, engagement: float, quality: float, recency: float) -> Tuple[float, Dict]:
+    overall = (
+        activity * SCORE_WEIGHTS["activity"] +
+        engagement * SCORE_WEIGHTS["engagement"] +
+        quality * SCORE_WEIGHTS["quality"] +
+        recency * SCORE_WEIGHTS["recency"]
+    )
+    
+    return overall, {
+        "activity": round(activity, 2),
+        "engagement": round(engagement, 2),
+        "quality": round(quality, 2),
+        "recency": round(recency, 2),
+        "overall": round(overall, 2)
+    }
+
+def _inputs_hash(post_stats: tuple, profile: tuple) -> bytes:
+    """
+    Stable digest of everything an agent's scores depend on. days_since only
+    matters through its bucket, so dormant agents keep the same key day to day
+    (the activity bonus bounds are a subset of the recency bounds).
+    """
+    post_count, days_since, upvotes, downvotes, comments = post_stats
+    bucket = None if days_since is None else bisect_right(RECENCY_DAY_BOUNDS, days_since)
+    key = (SCORING_VERSION, post_count, bucket, upvotes, downvotes, comments, *profile)
+    return hashlib.blake2b(repr(key).encode(), digest_size=16).digest()
+
+def _score_agent(post_count, days_since, upvotes, downvotes, comments,
+                 is_verified, has_long_bio, follower_count, has_display_name) -> tuple:
+    """
+    One agent's component scores (activity, engagement, quality, recency)
+    in a single call for the bulk pass; weighting and rounding happen in SQL
+    """
+    return (
+        _activity_from_row(post_count, days_since),
+        _engagement_from_row(upvotes, downvotes, comments, post_count),
+        _quality_from_row(is_verified, has_long_bio, follower_count, has_display_name),
+        _recency_from_row(days_since)
+    )
+
 class RankingEngine:
+    # Per-agent lookups behind the calculate_* methods, built once so each
+    # call is a straight conn.execute() against the cached prepared statement
+    ACTIVITY_SQL = f"""
+        SELECT COUNT(*), {DAYS_SINCE_LAST_POST}
+        FROM posts
+        WHERE agent_id = ?
+    """
+    ENGAGEMENT_SQL = """
+        SELECT 
+            SUM(upvotes) as total_upvotes,
+            SUM(downvotes) as total_downvotes,
+            SUM(comment_count) as total_comments,
+            COUNT(*) as post_count
+        FROM posts 
+        WHERE agent_id = ?
+    """
+    QUALITY_SQL = f"""
+        SELECT {QUALITY_COLUMNS}
+        FROM agents 
+        WHERE id = ?
+    """
+    RECENCY_SQL = f"""
+        SELECT {DAYS_SINCE_LAST_POST}
+        FROM posts
+        WHERE agent_id = ?
+    """
+    
     def __init__(self):
         self.db_path = DB_PATH
+        self._conn = None
     
     def _get_db(self):
-        return sqlite3.connect(self.db_path)
+        """Get the engine's database connection, opened once and reused"""
+        if self._conn is None:
+            # Autocommit; update_all_rankings opens its own transaction
+            self._conn = sqlite3.connect(self.db_path, isolation_level=None)
+            self._conn.executescript("""
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=NORMAL;
+                PRAGMA temp_store=MEMORY;
+                PRAGMA cache_size=-64000;
+                PRAGMA busy_timeout=30000;
+            """)
+            apply_schema(self._conn)
+        return self._conn
+    
+    def close(self):
+        """Close the database connection"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
     
     def calculate_activity_score(self, agent_id: str) -> float:
         """
@@ -25,41 +221,8 @@ class RankingEngine:
         - More posts = higher score (with diminishing returns)
         - Recent activity weighted more heavily
         """
-        conn = self._get_db()
-        cursor = conn.cursor()
-        
-        # Get post count
-        cursor.execute("""
-            SELECT COUNT(*), MAX(posted_at) 
-            FROM posts 
-            WHERE agent_id = ?
-        """, (agent_id,))
-        
-        post_count, last_post = cursor.fetchone()
-        conn.close()
-        
-        if not post_count:
-            return 0.0
-        
-        # Base score from post count (logarithmic scaling)
-        base_score = min(math.log10(post_count + 1) * 20, 50)
-        
-        # Recency bonus
-        recency_bonus = 0
-        if last_post:
-            try:
-                last_post_dt = datetime.fromisoformat(last_post.replace('Z', '+00:00'))
-                days_since = (datetime.now() - last_post_dt).days
-                if days_since < 1:
-                    recency_bonus = 25
-                elif days_since < 7:
-                    recency_bonus = 15
-                elif days_since < 30:
-                    recency_bonus = 5
-            except:
-                pass
-        
-        return min(base_score + recency_bonus, 100)
+        post_count, days_since = self._get_db().execute(self.ACTIVITY_SQL, (agent_id,)).fetchone()
+        return _activity_from_row(post_count, days_since)
     
     def calculate_engagement_score(self, agent_id: str) -> float:
         """
@@ -67,47 +230,12 @@ class RankingEngine:
         - Quality over quantity
         - Upvote ratio matters
         """
-        conn = self._get_db()
-        cursor = conn.cursor()
+        row = self._get_db().execute(self.ENGAGEMENT_SQL, (agent_id,)).fetchone()
         
-        cursor.execute("""
-            SELECT 
-                SUM(upvotes) as total_upvotes,
-                SUM(downvotes) as total_downvotes,
-                SUM(comment_count) as total_comments,
-                COUNT(*) as post_count
-            FROM posts 
-            WHERE agent_id = ?
-        """, (agent_id,))
-        
-        row = cursor.fetchone()
-        conn.close()
-        
-        if not row or not row[0]:
+        if not row:
             return 0.0
         
-        total_upvotes = row[0] or 0
-        total_downvotes = row[1] or 0
-        total_comments = row[2] or 0
-        post_count = row[3] or 1
-        
-        # Upvote ratio (quality signal)
-        total_votes = total_upvotes + total_downvotes
-        if total_votes > 0:
-            upvote_ratio = total_upvotes / total_votes
-        else:
-            upvote_ratio = 0.5
-        
-        # Average engagement per post
-        avg_upvotes = total_upvotes / post_count
-        avg_comments = total_comments / post_count
-        
-        # Score components
-        upvote_score = min(avg_upvotes * 5, 40)  # Cap at 40
-        comment_score = min(avg_comments * 10, 30)  # Cap at 30
-        ratio_score = upvote_ratio * 20  # Max 20
-        
-        return min(upvote_score + comment_score + ratio_score, 100)
+        return _engagement_from_row(*row)
     
     def calculate_quality_score(self, agent_id: str) -> float:
         """
@@ -116,85 +244,24 @@ class RankingEngine:
         - Profile completeness
         - Follower count (social proof)
         """
-        conn = self._get_db()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT is_verified, bio, follower_count, display_name
-            FROM agents 
-            WHERE id = ?
-        """, (agent_id,))
-        
-        row = cursor.fetchone()
-        conn.close()
+        row = self._get_db().execute(self.QUALITY_SQL, (agent_id,)).fetchone()
         
         if not row:
             return 0.0
         
-        is_verified, bio, follower_count, display_name = row
-        
-        score = 0
-        
-        # Verification bonus
-        if is_verified:
-            score += 30
-        
-        # Profile completeness
-        if bio and len(bio) > 20:
-            score += 20
-        if display_name:
-            score += 10
-        
-        # Social proof (followers)
-        if follower_count:
-            if follower_count > 1000:
-                score += 20
-            elif follower_count > 100:
-                score += 15
-            elif follower_count > 10:
-                score += 10
-        
-        return min(score, 100)
+        return _quality_from_row(*row)
     
     def calculate_recency_score(self, agent_id: str) -> float:
         """
         Recency score - rewards active agents
         - Decay function based on last activity
         """
-        conn = self._get_db()
-        cursor = conn.cursor()
+        row = self._get_db().execute(self.RECENCY_SQL, (agent_id,)).fetchone()
         
-        cursor.execute("""
-            SELECT MAX(posted_at), MAX(created_at)
-            FROM posts 
-            WHERE agent_id = ?
-        """, (agent_id,))
-        
-        row = cursor.fetchone()
-        conn.close()
-        
-        if not row or not row[0]:
+        if not row:
             return 0.0
         
-        last_post = row[0]
-        
-        try:
-            last_post_dt = datetime.fromisoformat(last_post.replace('Z', '+00:00'))
-            days_since = (datetime.now() - last_post_dt).days
-            
-            # Exponential decay
-            if days_since < 1:
-                return 100
-            elif days_since < 7:
-                return 80
-            elif days_since < 30:
-                return 50
-            elif days_since < 90:
-                return 25
-            else:
-                return 10
-        except:
-            return 0.0
+        return _recency_from_row(row[0])
     
     def calculate_overall_score(self, agent_id: str) -> Tuple[float, Dict]:
         """
@@ -205,68 +272,176 @@ class RankingEngine:
         quality = self.calculate_quality_score(agent_id)
         recency = self.calculate_recency_score(agent_id)
         
-        # Weighted average
-        # Engagement and quality matter more than raw activity
-        overall = (
-            activity * 0.25 +
-            engagement * 0.35 +
-            quality * 0.25 +
-            recency * 0.15
-        )
-        
-        return overall, {
-            "activity": round(activity, 2),
-            "engagement": round(engagement, 2),
-            "quality": round(quality, 2),
-            "recency": round(recency, 2),
-            "overall": round(overall, 2)
-        }
+        return _score_breakdown(activity, engagement, quality, recency)
+    
+    def update_category_columns(self, cursor):
+        """
+        Denormalize each agent's categories onto the agents row so the API
+        read path doesn't need the agent_categories/categories join
+        """
+        cursor.execute("""
+            UPDATE agents SET
+                primary_category = (
+                    SELECT c.name
+                    FROM agent_categories ac
+                    JOIN categories c ON ac.category_id = c.id
+                    WHERE ac.agent_id = agents.id
+                    ORDER BY ac.confidence DESC, ac.category_id
+                    LIMIT 1
+                ),
+                topics_csv = (
+                    SELECT GROUP_CONCAT(name) FROM (
+                        SELECT c.name
+                        FROM agent_categories ac
+                        JOIN categories c ON ac.category_id = c.id
+                        WHERE ac.agent_id = agents.id
+                        ORDER BY ac.confidence DESC, ac.category_id
+                    )
+                )
+        """)
+    
+    def update_top_agents_by_category(self, cursor):
+        """
+        Materialize each category's top TOP_AGENTS_PER_CATEGORY agents so
+        get_top_agents(category) is a primary-key range scan
+        """
+        cursor.execute("DELETE FROM top_agents_by_category")
+        cursor.execute("""
+            INSERT INTO top_agents_by_category (category, rank, agent_id)
+            SELECT category, rank, agent_id FROM (
+                SELECT c.name AS category, ac.agent_id,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY c.name
+                           ORDER BY r.overall_score DESC, ac.agent_id
+                       ) AS rank
+                FROM agent_categories ac
+                JOIN categories c ON ac.category_id = c.id
+                JOIN agents a ON a.id = ac.agent_id
+                JOIN rankings r ON r.agent_id = ac.agent_id
+            )
+            WHERE rank <= ?
+        """, (TOP_AGENTS_PER_CATEGORY,))
+    
+    def _bulk_fetch_post_stats(self, cursor) -> Dict[str, tuple]:
+        """Per-agent post aggregates for every agent in one GROUP BY"""
+        cursor.execute(f"""
+            SELECT agent_id, COUNT(*), {DAYS_SINCE_LAST_POST},
+                   SUM(upvotes), SUM(downvotes), SUM(comment_count)
+            FROM posts
+            GROUP BY agent_id
+        """)
+        return {row[0]: row[1:] for row in cursor}
+    
+    def _bulk_fetch_agent_profiles(self, cursor) -> Dict[str, tuple]:
+        """Quality inputs for every agent in one SELECT"""
+        cursor.execute(f"SELECT id, {QUALITY_COLUMNS} FROM agents")
+        return {row[0]: row[1:] for row in cursor}
+    
+    def _fetch_ranking_cache(self, cursor) -> Dict[str, bytes]:
+        """Input hashes of agents whose rankings row is still present"""
+        cursor.execute("""
+            SELECT rc.agent_id, rc.inputs_hash
+            FROM ranking_cache rc
+            JOIN rankings r ON r.agent_id = rc.agent_id
+        """)
+        return dict(cursor)
     
     def update_all_rankings(self):
         """Update rankings for all agents"""
         conn = self._get_db()
         cursor = conn.cursor()
         
-        cursor.execute("SELECT id FROM agents")
-        agents = cursor.fetchall()
-        
-        print(f"🧮 Calculating rankings for {len(agents)} agents...")
-        
-        updated = 0
-        for (agent_id,) in agents:
-            overall, breakdown = self.calculate_overall_score(agent_id)
+        # Take the write lock up front, so the bulk reads and the writes see
+        # one snapshot and the whole pass is a single journaled transaction;
+        # `with conn` commits it, or rolls back if anything raises
+        cursor.execute("BEGIN IMMEDIATE")
+        with conn:
+            # Everything the scores need, fetched up front instead of four
+            # queries (and connections) per agent
+            post_stats = self._bulk_fetch_post_stats(cursor)
+            profiles = self._bulk_fetch_agent_profiles(cursor)
+            cached = self._fetch_ranking_cache(cursor)
             
+            print(f"🧮 Calculating rankings for {len(profiles)} agents...")
+            
+            calculated_at = datetime.now().isoformat()
+            no_posts = (0, None, None, None, None)
+            rows, cache_rows = [], []
+            for agent_id, profile in profiles.items():
+                stats = post_stats.get(agent_id, no_posts)
+                inputs_hash = _inputs_hash(stats, profile)
+                if cached.get(agent_id) == inputs_hash:
+                    continue  # Nothing the scores depend on has changed
+                
+                rows.append((agent_id, *_score_agent(*stats, *profile)))
+                cache_rows.append((agent_id, inputs_hash))
+            
+            # Stage the raw components; SQLite computes the weighted overall
+            # and rounds everything while copying them into rankings
             cursor.execute("""
-                INSERT OR REPLACE INTO rankings 
+                CREATE TEMP TABLE IF NOT EXISTS ranking_components (
+                    agent_id TEXT PRIMARY KEY,
+                    activity REAL, engagement REAL, quality REAL, recency REAL
+                )
+            """)
+            cursor.execute("DELETE FROM ranking_components")
+            cursor.executemany("INSERT INTO ranking_components VALUES (?, ?, ?, ?, ?)", rows)
+            # Upserts update rows in place instead of delete + reinsert, and
+            # leave columns this pass doesn't compute (trending_score,
+            # category_rank) alone. `WHERE true` keeps SQLite from parsing
+            # ON CONFLICT as a join constraint of the SELECT.
+            cursor.execute(f"""
+                INSERT INTO rankings 
                 (agent_id, overall_score, activity_score, engagement_score, 
                  quality_score, recency_score, last_calculated)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (
-                agent_id,
-                breakdown["overall"],
-                breakdown["activity"],
-                breakdown["engagement"],
-                breakdown["quality"],
-                breakdown["recency"],
-                datetime.now().isoformat()
-            ))
+                SELECT agent_id, ROUND({OVERALL_SCORE_SQL}, 2),
+                       ROUND(activity, 2), ROUND(engagement, 2),
+                       ROUND(quality, 2), ROUND(recency, 2), ?
+                FROM ranking_components
+                WHERE true
+                ON CONFLICT(agent_id) DO UPDATE SET
+                    overall_score = excluded.overall_score,
+                    activity_score = excluded.activity_score,
+                    engagement_score = excluded.engagement_score,
+                    quality_score = excluded.quality_score,
+                    recency_score = excluded.recency_score,
+                    last_calculated = excluded.last_calculated
+            """, (calculated_at,))
+            cursor.executemany("""
+                INSERT INTO ranking_cache (agent_id, inputs_hash)
+                VALUES (?, ?)
+                ON CONFLICT(agent_id) DO UPDATE SET inputs_hash = excluded.inputs_hash
+            """, cache_rows)
+            updated = len(rows)
             
-            updated += 1
-            if updated % 10 == 0:
-                print(f"  ...{updated} agents ranked")
+            self.update_category_columns(cursor)
+            self.update_top_agents_by_category(cursor)
         
-        conn.commit()
-        conn.close()
-        
-        print(f"✅ Rankings updated for {updated} agents")
+        print(f"✅ Rankings updated for {updated} agents ({len(profiles) - updated} unchanged)")
         return updated
     
     def get_top_agents(self, category: str = None, limit: int = 10) -> List[Dict]:
         """Get top agents by category or overall"""
         conn = self._get_db()
         cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row  # This cursor only; the scoring paths unpack plain tuples
         
-        if category and category != "all":
+        if category and category != "all" and limit <= TOP_AGENTS_PER_CATEGORY:
+            # Precomputed leaderboard from the last ranking pass
+            cursor.execute("""
+                SELECT 
+                    a.id, a.username, a.display_name, a.bio, a.avatar_url,
+                    a.follower_count, a.is_verified,
+                    r.overall_score, r.activity_score, r.engagement_score,
+                    r.quality_score, r.recency_score,
+                    t.category
+                FROM top_agents_by_category t
+                JOIN agents a ON a.id = t.agent_id
+                JOIN rankings r ON r.agent_id = t.agent_id
+                WHERE t.category = ? AND t.rank <= ?
+                ORDER BY t.rank
+            """, (category, limit))
+        elif category and category != "all":
             cursor.execute("""
                 SELECT 
                     a.id, a.username, a.display_name, a.bio, a.avatar_url,
@@ -296,30 +471,23 @@ class RankingEngine:
                 LIMIT ?
             """, (limit,))
         
-        rows = cursor.fetchall()
-        conn.close()
-        
-        agents = []
-        for row in rows:
-            agents.append({
-                "id": row[0],
-                "username": row[1],
-                "display_name": row[2],
-                "bio": row[3],
-                "avatar_url": row[4],
-                "follower_count": row[5],
-                "is_verified": row[6],
-                "scores": {
-                    "overall": row[7],
-                    "activity": row[8],
-                    "engagement": row[9],
-                    "quality": row[10],
-                    "recency": row[11]
-                },
-                "category": row[12]
-            })
-        
-        return agents
+        return [{
+            "id": row["id"],
+            "username": row["username"],
+            "display_name": row["display_name"],
+            "bio": row["bio"],
+            "avatar_url": row["avatar_url"],
+            "follower_count": row["follower_count"],
+            "is_verified": row["is_verified"],
+            "scores": {
+                "overall": row["overall_score"],
+                "activity": row["activity_score"],
+                "engagement": row["engagement_score"],
+                "quality": row["quality_score"],
+                "recency": row["recency_score"]
+            },
+            "category": row["category"]
+        } for row in cursor]
 
 if __name__ == "__main__":
     engine = RankingEngine()
@@ -332,3 +500,5 @@ if __name__ == "__main__":
         name = agent["display_name"] or agent["username"]
         score = agent["scores"]["overall"]
         print(f"{i}. {name} - Score: {score}")
+    
+    engine.close()